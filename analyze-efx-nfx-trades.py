@@ -1,8 +1,6 @@
 import sqlite3
 import pandas as pd
 import numpy as np
-from typing import List, Dict, Tuple
-from datetime import datetime
 import logging
 
 logging.basicConfig(
@@ -11,157 +9,152 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Role bits of the actions making up a trade
+ROLE_EFX = 1
+ROLE_NFX = 2
+ROLE_FEE = 4
+
+# Number of rows fetched from SQLite per batch
+FETCH_CHUNK_SIZE = 65536
+
 class TradeAnalyzer:
     def __init__(self, db_path: str = "eos_history.db"):
         self.db_path = db_path
         self.logger = logger
 
-    def parse_quantity(self, quantity_str: str) -> Tuple[float, str]:
-        """Parse quantity string into amount and token"""
-        try:
-            if not quantity_str:
-                return 0.0, ''
-            amount_str, token = quantity_str.strip().split(' ')
-            return float(amount_str), token
-        except Exception as e:
-            self.logger.error(f"Error parsing quantity '{quantity_str}': {str(e)}")
-            return 0.0, ''
-
-    def get_trades(self) -> List[Dict]:
+    def get_trades(self) -> pd.DataFrame:
         """Find and analyze all EFX/NFX trades"""
-        trades = []
-        
         with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT 
-                    trx_id,
-                    block_time as time,
-                    actor,
-                    from_account,
-                    to_account,
-                    memo,
-                    quantity
-                FROM actions
-                WHERE 
-                    action_name = 'transfer'
-                    AND (
-                        memo LIKE 'swap,%'
-                        OR memo = 'Defibox: swap token'
-                        OR to_account = 'fees.defi'
-                    )
-                ORDER BY block_time, trx_id
-            """)
-            
-            rows = cursor.fetchall()
 
-        # Group transactions by trx_id
-        current_trx = None
-        current_group = []
-        
-        for row in rows:
-            if row['trx_id'] != current_trx:
-                if current_group:
-                    trade = self.analyze_trade_group(current_group)
-                    if trade:
-                        trades.append(trade)
-                current_trx = row['trx_id']
-                current_group = [dict(row)]
-            else:
-                current_group.append(dict(row))
-        
-        # Process last group
-        if current_group:
-            trade = self.analyze_trade_group(current_group)
-            if trade:
-                trades.append(trade)
+            # Read-side tuning: memory-map the file and use a larger page cache
+            cursor.execute("PRAGMA mmap_size = 268435456")
+            cursor.execute("PRAGMA cache_size = -131072")
+
+            # Covering index so the trade query is served from the index alone,
+            # already ordered by trx_id for the per-transaction count
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_actions_swap ON actions(
+                    action_name, trx_id, block_time, to_account,
+                    memo, from_account, quantity
+                )
+            ''')
 
-        return trades
+            # Only keep actions of transactions with exactly three matching
+            # actions; ordering keeps each transaction's rows adjacent.
+            # Rows are fetched in chunks so at most one batch of Python row
+            # tuples is alive at a time
+            chunks = pd.read_sql_query("""
+                SELECT trx_id, time, to_account, memo, from_account, quantity
+                FROM (
+                    SELECT 
+                        trx_id,
+                        block_time as time,
+                        COALESCE(to_account, '') as to_account,
+                        COALESCE(memo, '') as memo,
+                        COALESCE(from_account, '') as from_account,
+                        COALESCE(quantity, '') as quantity,
+                        COUNT(*) OVER (PARTITION BY trx_id) as action_count
+                    FROM actions
+                    WHERE 
+                        action_name = 'transfer'
+                        AND (
+                            memo LIKE 'swap,%'
+                            OR memo = 'Defibox: swap token'
+                            OR to_account = 'fees.defi'
+                        )
+                )
+                WHERE action_count = 3
+                ORDER BY time, trx_id
+            """, conn, chunksize=FETCH_CHUNK_SIZE)
+            raw = pd.concat(chunks, ignore_index=True)
+
+        if raw.empty:
+            return pd.DataFrame()
+
+        # Parse "1.0000 EFX" quantities into amount and token columns
+        amount_token = raw['quantity'].str.partition(' ')
+        parsed = pd.to_numeric(amount_token[0], errors='coerce')
+        invalid = parsed.isna() & (raw['quantity'] != '')
+        if invalid.any():
+            self.logger.error(
+                f"Error parsing {invalid.sum()} quantities, e.g. '{raw['quantity'][invalid].iloc[0]}'"
+            )
+        # Unparsable legs get no token, so they match no role and their trade
+        # is dropped
+        raw['amount'] = parsed.fillna(0.0)
+        raw['token'] = amount_token[2].where(parsed.notna(), '')
+
+        # Classify each action as the EFX leg, NFX leg or fee of its trade,
+        # one bit per role
+        roles = np.select(
+            [raw['to_account'] == 'fees.defi', raw['token'] == 'EFX', raw['token'] == 'NFX'],
+            [ROLE_FEE, ROLE_EFX, ROLE_NFX],
+            default=0
+        ).reshape(-1, 3)
+
+        # Each transaction is three adjacent rows; it is a valid trade only
+        # if it has exactly one leg of each role
+        valid = roles.sum(axis=1) == (ROLE_EFX | ROLE_NFX | ROLE_FEE)
+        rows = np.arange(len(raw)).reshape(-1, 3)[valid]
+        roles = roles[valid]
+        efx = raw.iloc[rows[roles == ROLE_EFX]]
+        nfx = raw.iloc[rows[roles == ROLE_NFX]]
+        fee = raw.iloc[rows[roles == ROLE_FEE]]
 
-    def analyze_trade_group(self, transactions: List[Dict]) -> Dict:
-        """Analyze a group of transactions with the same trx_id"""
-        # Only process groups with exactly three actions
-        if len(transactions) != 3:
-            return None
-            
-        efx_tx = None
-        nfx_tx = None
-        fee_tx = None
-        
-        for tx in transactions:
-            # Categorize each transaction
-            amount, token = self.parse_quantity(tx['quantity'])
-            
-            if tx['to_account'] == 'fees.defi':
-                fee_tx = {**tx, 'amount': amount}
-            elif token == 'EFX':
-                efx_tx = {**tx, 'amount': amount}
-            elif token == 'NFX':
-                nfx_tx = {**tx, 'amount': amount}
-        
-        # Verify we have all components of a valid trade
-        if not all([efx_tx, nfx_tx, fee_tx]):
-            return None
-            
-        # Calculate ratio as EFX/NFX regardless of direction
-        ratio = efx_tx['amount'] / nfx_tx['amount']
-        
         # Determine trade direction and trader
-        if 'swap,' in efx_tx['memo']:
-            direction = 'EFX_TO_NFX'
-            trader = efx_tx['from_account']
-        else:
-            direction = 'NFX_TO_EFX'
-            trader = nfx_tx['from_account']
-        
-        return {
-            'timestamp': efx_tx['time'],
-            'trx_id': efx_tx['trx_id'],
-            'trader': trader,
-            'direction': direction,
-            'efx_amount': efx_tx['amount'],
-            'nfx_amount': nfx_tx['amount'],
-            'ratio': ratio,
-            'fee_amount': fee_tx['amount']
-        }
+        efx_to_nfx = efx['memo'].str.contains('swap,', regex=False).to_numpy()
 
-    def calculate_vwap(self, df: pd.DataFrame) -> float:
-        """Calculate volume-weighted average price"""
-        return (df['ratio'] * df['efx_amount']).sum() / df['efx_amount'].sum()
+        # trader and direction repeat heavily, so store them as categoricals
+        return pd.DataFrame({
+            'timestamp': efx['time'].to_numpy(),
+            'trx_id': efx['trx_id'].to_numpy(),
+            'trader': pd.Categorical(np.where(efx_to_nfx, efx['from_account'], nfx['from_account'])),
+            'direction': pd.Categorical.from_codes(
+                np.where(efx_to_nfx, 0, 1).astype(np.int8),
+                categories=['EFX_TO_NFX', 'NFX_TO_EFX']
+            ),
+            'efx_amount': efx['amount'].to_numpy(),
+            'nfx_amount': nfx['amount'].to_numpy(),
+            # Calculate ratio as EFX/NFX regardless of direction
+            'ratio': efx['amount'].to_numpy() / nfx['amount'].to_numpy(),
+            'fee_amount': fee['amount'].to_numpy()
+        })
 
     def calculate_daily_average(self, df: pd.DataFrame) -> float:
         """Calculate average of daily averages"""
-        daily_averages = df.groupby(df['timestamp'].dt.date)['ratio'].mean()
+        # Reuse the caller's day buckets when present, else derive them
+        if 'date' in df:
+            days = df['date']
+        else:
+            days = pd.to_datetime(df['timestamp']).to_numpy().astype('datetime64[D]')
+        daily_averages = df.groupby(days, sort=False, observed=True)['ratio'].mean()
         return daily_averages.mean()
 
-    def analyze_price_ranges(self, df: pd.DataFrame) -> pd.DataFrame:
+    def analyze_price_ranges(self, df: pd.DataFrame, total_efx: float = None) -> pd.DataFrame:
         """Analyze trading activity by price ranges"""
         try:
-            max_price = np.ceil(df['ratio'].max())
-            bins = np.arange(0, max_price + 1, 1)
-            labels = [f"{i:.0f}-{i+1:.0f}" for i in bins[:-1]]
+            if total_efx is None:
+                total_efx = df['efx_amount'].sum()
             
-            df['price_range'] = pd.cut(df['ratio'], bins=bins, labels=labels, right=False)
+            # Bins are [i, i+1), so the bin code is just the floor of the ratio;
+            # labels are only built for the bins that end up in the result.
+            # NaN/inf (0/0 and x/0 trades) and negative ratios fall in no bin
+            ratios = df['ratio'].to_numpy()
+            binned = np.isfinite(ratios) & (ratios >= 0)
+            df['price_range'] = pd.array(np.where(binned, np.floor(ratios), np.nan), dtype='Int32')
+            if '_wprod' not in df:
+                df['_wprod'] = df['ratio'] * df['efx_amount']
             
-            # Basic statistics
-            basic_stats = df.groupby('price_range').agg({
+            # Basic statistics, including the ratio * volume sum for the weighted mean
+            basic_stats = df.groupby('price_range', observed=True).agg({
                 'trx_id': 'count',
                 'trader': 'nunique',
                 'efx_amount': 'sum',
                 'nfx_amount': 'sum',
-                'ratio': ['mean', 'min', 'max']
+                'ratio': ['mean', 'min', 'max'],
+                '_wprod': 'sum'
             })
-
-            # Calculate weighted mean safely
-            def safe_weighted_mean(group):
-                efx_sum = group['efx_amount'].sum()
-                if efx_sum == 0:
-                    return np.nan
-                return (group['ratio'] * group['efx_amount']).sum() / efx_sum
-
-            weighted_means = df.groupby('price_range').apply(safe_weighted_mean)
             
             # Flatten and rename columns
             basic_stats.columns = [
@@ -171,14 +164,24 @@ class TradeAnalyzer:
                 'nfx_volume',
                 'simple_mean',
                 'min_ratio',
-                'max_ratio'
+                'max_ratio',
+                'wprod_sum'
             ]
             
+            # Weighted mean from the per-range sums (NaN for zero volume)
+            efx_volume = basic_stats['efx_volume']
+            weighted_means = basic_stats.pop('wprod_sum') / efx_volume.where(efx_volume != 0)
+            
+            # Label the bins, e.g. code 2 -> "2-3"
+            basic_stats.index = pd.Index(
+                [f"{i}-{i+1}" for i in basic_stats.index], name='price_range'
+            )
+            weighted_means.index = basic_stats.index
+            
             # Add weighted mean and volume percentage
-            total_efx_volume = df['efx_amount'].sum()
             result = basic_stats.assign(
                 weighted_mean=weighted_means,
-                volume_percentage=(basic_stats['efx_volume'] / total_efx_volume * 100).round(2)
+                volume_percentage=(basic_stats['efx_volume'] / total_efx * 100).round(2)
             )
             
             return result.round(4)
@@ -188,53 +191,31 @@ class TradeAnalyzer:
             raise
 
 
-    def analyze_top_traders(self, df: pd.DataFrame) -> pd.DataFrame:
+    def analyze_top_traders(self, df: pd.DataFrame, total_efx: float = None) -> pd.DataFrame:
             """Analyze traders with both simple and weighted averages"""
             try:
-                # Calculate basic stats more explicitly
-                trader_stats = df.groupby('trader').agg({
-                    'trx_id': 'count',
-                    'efx_amount': 'sum',
-                    'nfx_amount': 'sum'
-                })
+                if total_efx is None:
+                    total_efx = df['efx_amount'].sum()
+                if '_wprod' not in df:
+                    df['_wprod'] = df['ratio'] * df['efx_amount']
                 
-                # Calculate ratios separately
-                ratio_stats = df.groupby('trader')['ratio'].agg(['min', 'max', 'mean']).rename(
-                    columns={'mean': 'simple_mean_ratio'}
+                # Calculate all per-trader stats in a single pass
+                result = df.groupby('trader', sort=False, observed=True).agg(
+                    trade_count=('trx_id', 'count'),
+                    efx_volume=('efx_amount', 'sum'),
+                    nfx_volume=('nfx_amount', 'sum'),
+                    min_ratio=('ratio', 'min'),
+                    max_ratio=('ratio', 'max'),
+                    simple_mean_ratio=('ratio', 'mean'),
+                    wprod_sum=('_wprod', 'sum')
                 )
 
-                # Calculate weighted mean with error handling
-                def safe_weighted_mean(group):
-                    efx_sum = group['efx_amount'].sum()
-                    if efx_sum == 0:
-                        return np.nan
-                    return (group['ratio'] * group['efx_amount']).sum() / efx_sum
-
-                weighted_means = df.groupby('trader').apply(safe_weighted_mean).rename('weighted_mean_ratio')
+                # Weighted mean from the per-trader sums (NaN for zero volume)
+                efx_volume = result['efx_volume']
+                result['weighted_mean_ratio'] = result.pop('wprod_sum') / efx_volume.where(efx_volume != 0)
 
                 # Calculate volume percentage
-                total_efx = df['efx_amount'].sum()
-                volume_percentage = (trader_stats['efx_amount'] / total_efx * 100).round(4)
-
-                # Combine all stats
-                result = pd.concat([
-                    trader_stats,
-                    ratio_stats,
-                    weighted_means,
-                    volume_percentage.rename('volume_percentage')
-                ], axis=1)
-
-                # Rename columns for clarity
-                result.columns = [
-                    'trade_count',
-                    'efx_volume',
-                    'nfx_volume',
-                    'min_ratio',
-                    'max_ratio',
-                    'simple_mean_ratio',
-                    'weighted_mean_ratio',
-                    'volume_percentage'
-                ]
+                result['volume_percentage'] = (efx_volume / total_efx * 100).round(4)
 
                 # Sort by volume and round
                 return result.sort_values('efx_volume', ascending=False).round(4)
@@ -248,45 +229,52 @@ class TradeAnalyzer:
         """Analyze trades and export to Excel with enhanced statistics"""
         self.logger.info("Starting trade analysis...")
         
-        trades = self.get_trades()
+        df = self.get_trades()
         
-        if not trades:
+        if df.empty:
             self.logger.warning("No trades found!")
             return
         
-        # Convert to DataFrame
-        df = pd.DataFrame(trades)
         df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df['date'] = df['timestamp'].dt.date
+        # Day buckets as datetime64 rather than one Python date object per row
+        df['date'] = df['timestamp'].dt.floor('D')
+        
+        # Ratio * volume, summed per group for volume-weighted means
+        df['_wprod'] = df['ratio'] * df['efx_amount']
         
         # Get date range
         first_trade = df['timestamp'].min()
         last_trade = df['timestamp'].max()
         date_range = f"{first_trade} to {last_trade}"
         
+        # Column totals, computed once and shared with the breakdowns
+        total_efx = float(df['efx_amount'].sum())
+        total_nfx = float(df['nfx_amount'].sum())
+        min_ratio, max_ratio, simple_avg = df['ratio'].agg(['min', 'max', 'mean'])
+        
         # Calculate all average types
-        vwap = self.calculate_vwap(df)
-        simple_avg = df['ratio'].mean()
+        vwap = df['_wprod'].sum() / total_efx
         daily_avg = self.calculate_daily_average(df)
+        direction_counts = df['direction'].value_counts()
         
         # Calculate statistics
         stats = {
             'date_range': date_range,
             'total_trades': len(df),
             'unique_traders': df['trader'].nunique(),
-            'total_efx_volume': df['efx_amount'].sum(),
-            'total_nfx_volume': df['nfx_amount'].sum(),
+            'total_efx_volume': total_efx,
+            'total_nfx_volume': total_nfx,
             'vwap_ratio': vwap,
             'simple_avg_ratio': simple_avg,
             'daily_avg_ratio': daily_avg,
-            'min_ratio': df['ratio'].min(),
-            'max_ratio': df['ratio'].max(),
-            'efx_to_nfx_trades': len(df[df['direction'] == 'EFX_TO_NFX']),
-            'nfx_to_efx_trades': len(df[df['direction'] == 'NFX_TO_EFX'])
+            'min_ratio': min_ratio,
+            'max_ratio': max_ratio,
+            'efx_to_nfx_trades': int(direction_counts.get('EFX_TO_NFX', 0)),
+            'nfx_to_efx_trades': int(direction_counts.get('NFX_TO_EFX', 0))
         }
         
-        # Export to Excel
-        with pd.ExcelWriter(output_file) as writer:
+        # Export to Excel (xlsxwriter streams XML out and is faster than openpyxl)
+        with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
             # All trades
             df.to_excel(
                 writer,
@@ -297,27 +285,31 @@ class TradeAnalyzer:
             )
             
             # Price range analysis with weighted means
-            price_analysis = self.analyze_price_ranges(df)
+            price_analysis = self.analyze_price_ranges(df, total_efx)
             price_analysis.to_excel(writer, sheet_name='Price Analysis')
             
-            # Daily breakdown with all metrics
-            daily_stats = df.groupby('date').agg({
+            # Daily breakdown with all metrics, VWAP derived from the same pass
+            # (trades are in time order, so groups already come out by date)
+            daily_stats = df.groupby('date', sort=False, observed=True).agg({
                 'trx_id': 'count',
                 'trader': 'nunique',
                 'ratio': ['mean', 'min', 'max'],
                 'efx_amount': 'sum',
-                'nfx_amount': 'sum'
-            }).round(4)
-            
-            # Add daily VWAP
-            daily_stats['vwap'] = df.groupby('date').apply(self.calculate_vwap)
+                'nfx_amount': 'sum',
+                '_wprod': 'sum'
+            })
+            daily_wprod = daily_stats.pop(('_wprod', 'sum'))
+            daily_efx = daily_stats[('efx_amount', 'sum')]
+            daily_stats = daily_stats.round(4)
+            daily_stats['vwap'] = daily_wprod / daily_efx
+            daily_stats.index = pd.Index(daily_stats.index.date, name='date')
             daily_stats.to_excel(writer, sheet_name='Daily Stats')
             
             # Summary statistics
             pd.DataFrame([stats]).to_excel(writer, sheet_name='Summary', index=False)
             
             # Enhanced trader analysis
-            top_traders = self.analyze_top_traders(df)
+            top_traders = self.analyze_top_traders(df, total_efx)
             top_traders.to_excel(writer, sheet_name='Trader Analysis')
         
         # Print summary
@@ -1,29 +1,107 @@
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
+import plotly.io as pio
 from plotly.subplots import make_subplots
 from datetime import datetime
+from pathlib import Path
 import numpy as np
 
+# Column types of the All Trades sheet, applied when reading the workbook and
+# re-applied to the Parquet copy so sidecars written by older versions match
+TRADES_DTYPES = {
+    'trx_id': 'string',
+    'trader': 'category',
+    'direction': 'category',
+    'efx_amount': 'float64',
+    'nfx_amount': 'float64',
+    'ratio': 'float64',
+    'fee_amount': 'float64'
+}
+
+def moving_average(values: np.ndarray, window: int) -> np.ndarray:
+    """Trailing moving average via cumulative sums, with rolling().mean()'s NaN handling"""
+    # Windows that are not yet full, or that contain a NaN, are NaN
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    sums = np.zeros(values.size + 1)
+    np.cumsum(np.where(missing, 0.0, values), out=sums[1:])
+    nans = np.zeros(values.size + 1, dtype=np.int64)
+    np.cumsum(missing, out=nans[1:])
+    result = np.full(values.size, np.nan)
+    if window <= values.size:
+        window_sums = sums[window:] - sums[:-window]
+        has_nan = (nans[window:] - nans[:-window]) > 0
+        result[window - 1:] = np.where(has_nan, np.nan, window_sums / window)
+    return result
+
 class TradeVisualizer:
     def __init__(self, data_file: str = "efx_nfx_trades.xlsx"):
         self.data_file = data_file
         self.load_data()
         
+    def read_trades_sheet(self) -> pd.DataFrame:
+        """Read the All Trades sheet from the Excel file"""
+        # calamine (Rust) parses xlsx far faster than openpyxl; explicit
+        # dtypes skip type inference, and the repetitive trader/direction
+        # columns are stored as categorical codes
+        return pd.read_excel(
+            self.data_file,
+            sheet_name='All Trades',
+            engine='calamine',
+            dtype=TRADES_DTYPES,
+            parse_dates=['timestamp']
+        )
+
     def load_data(self):
         """Load data from Excel file"""
         try:
-            self.trades_df = pd.read_excel(self.data_file, sheet_name='All Trades')
-            self.trades_df['timestamp'] = pd.to_datetime(self.trades_df['timestamp'])
-            self.trades_df['date'] = self.trades_df['timestamp'].dt.date
-
-            # Calculate price ranges for volume distribution
-            bins = np.arange(0, np.ceil(self.trades_df['ratio'].max()) + 1, 1)
-            self.trades_df['price_range'] = pd.cut(self.trades_df['ratio'], bins=bins)
-            self.price_analysis = self.trades_df.groupby('price_range').agg({
-                'efx_amount': 'sum',
-                'trx_id': 'count'
-            }).reset_index()
+            # Reuse the Parquet copy of the trades sheet while it is at least
+            # as new as the workbook; otherwise parse the Excel file and refresh it
+            parquet_file = Path(self.data_file).with_suffix('.parquet')
+            self.trades_df = None
+            if parquet_file.exists() and parquet_file.stat().st_mtime >= Path(self.data_file).stat().st_mtime:
+                try:
+                    trades_df = pd.read_parquet(parquet_file, engine='pyarrow')
+                    trades_df = trades_df.astype(TRADES_DTYPES)
+                    trades_df['timestamp'] = pd.to_datetime(trades_df['timestamp'])
+                    self.trades_df = trades_df
+                except (KeyError, ValueError, TypeError) as e:
+                    # Sidecar with an incompatible schema: rebuild it below
+                    print(f"Ignoring stale {parquet_file}: {str(e)}")
+            if self.trades_df is None:
+                self.trades_df = self.read_trades_sheet()
+                self.trades_df.to_parquet(parquet_file, engine='pyarrow', compression='zstd')
+
+            self.trades_df['date'] = self.trades_df['timestamp'].dt.floor('D')
+
+            # Contiguous column buffers shared by the summary and chart code
+            self.ratio = self.trades_df['ratio'].to_numpy()
+            self.efx_amount = self.trades_df['efx_amount'].to_numpy()
+
+            # Per-day aggregates, computed once and rolled up by both the
+            # summary stats and the price chart
+            self.daily_data = self.trades_df.groupby('date', sort=True).agg(
+                avg_ratio=('ratio', 'mean'),
+                min_ratio=('ratio', 'min'),
+                max_ratio=('ratio', 'max'),
+                volume=('efx_amount', 'sum')
+            ).reset_index()
+
+            # Volume distribution over [i, i+1) price ranges: the bin id is the
+            # truncated ratio, and each histogram is a single bincount pass.
+            # NaN/inf (e.g. 0/0 trades, blank cells) and negative ratios
+            # fall in no bin
+            binned = np.isfinite(self.ratio) & (self.ratio >= 0)
+            bin_id = self.ratio[binned].astype(np.int64)
+            volumes = np.bincount(bin_id, weights=self.efx_amount[binned])
+            counts = np.bincount(bin_id)
+            bins = np.flatnonzero(counts)
+            self.price_analysis = pd.DataFrame({
+                'price_range': [f"{i}-{i + 1}" for i in bins],
+                'efx_amount': volumes[bins],
+                'trx_id': counts[bins]
+            })
 
         except Exception as e:
             print(f"Error loading data: {str(e)}")
@@ -31,19 +109,30 @@ class TradeVisualizer:
 
     def get_summary_stats(self):
         """Calculate summary statistics"""
+        df = self.trades_df
+        ratio = self.ratio
+        # NaN-skipping reductions, like the pandas Series methods (blank
+        # cells in the sheet read back as NaN)
+        total_efx = np.nansum(self.efx_amount)
+        timestamps = df['timestamp']
+        direction_counts = df['direction'].value_counts()
+        # Ratio * volume over finite pairs only, like summing the products
+        # with NaN skipped
+        finite = np.isfinite(ratio) & np.isfinite(self.efx_amount)
+
         stats = {
-            'date_range': f"{self.trades_df['timestamp'].min():%Y-%m-%d} to {self.trades_df['timestamp'].max():%Y-%m-%d}",
-            'total_trades': len(self.trades_df),
-            'unique_traders': self.trades_df['trader'].nunique(),
-            'total_efx_volume': self.trades_df['efx_amount'].sum(),
-            'total_nfx_volume': self.trades_df['nfx_amount'].sum(),
-            'vwap_ratio': (self.trades_df['ratio'] * self.trades_df['efx_amount']).sum() / self.trades_df['efx_amount'].sum(),
-            'simple_avg_ratio': self.trades_df['ratio'].mean(),
-            'daily_avg_ratio': self.trades_df.groupby('date')['ratio'].mean().mean(),
-            'min_ratio': self.trades_df['ratio'].min(),
-            'max_ratio': self.trades_df['ratio'].max(),
-            'efx_to_nfx_trades': len(self.trades_df[self.trades_df['direction'] == 'EFX_TO_NFX']),
-            'nfx_to_efx_trades': len(self.trades_df[self.trades_df['direction'] == 'NFX_TO_EFX'])
+            'date_range': f"{timestamps.min():%Y-%m-%d} to {timestamps.max():%Y-%m-%d}",
+            'total_trades': len(df),
+            'unique_traders': df['trader'].cat.categories.size,
+            'total_efx_volume': total_efx,
+            'total_nfx_volume': np.nansum(df['nfx_amount'].to_numpy()),
+            'vwap_ratio': np.dot(ratio[finite], self.efx_amount[finite]) / total_efx,
+            'simple_avg_ratio': np.nanmean(ratio),
+            'daily_avg_ratio': self.daily_data['avg_ratio'].mean(),
+            'min_ratio': np.nanmin(ratio),
+            'max_ratio': np.nanmax(ratio),
+            'efx_to_nfx_trades': int(direction_counts.get('EFX_TO_NFX', 0)),
+            'nfx_to_efx_trades': int(direction_counts.get('NFX_TO_EFX', 0))
         }
         return stats
 
@@ -143,14 +232,21 @@ class TradeVisualizer:
 
         # Create and add charts
         # Price Chart
-        daily_data = self.trades_df.groupby('date').agg({
-            'ratio': ['mean', 'min', 'max'],
-            'efx_amount': 'sum'
-        }).reset_index()
-        daily_data.columns = ['date', 'avg_ratio', 'min_ratio', 'max_ratio', 'volume']
+        daily_data = self.daily_data.copy()
+        
+        daily_data['MA7'] = moving_average(daily_data['avg_ratio'].to_numpy(), 7)
+        daily_data['MA30'] = moving_average(daily_data['avg_ratio'].to_numpy(), 30)
         
-        daily_data['MA7'] = daily_data['avg_ratio'].rolling(window=7).mean()
-        daily_data['MA30'] = daily_data['avg_ratio'].rolling(window=30).mean()
+        # float32 is plenty on screen and halves the chart payload; the
+        # summary statistics above stay in float64
+        daily_data = daily_data.astype({
+            'avg_ratio': 'float32',
+            'min_ratio': 'float32',
+            'max_ratio': 'float32',
+            'volume': 'float32',
+            'MA7': 'float32',
+            'MA30': 'float32'
+        })
 
         fig1 = make_subplots(rows=2, cols=1, shared_xaxes=True, 
                            vertical_spacing=0.03, row_heights=[0.7, 0.3])
@@ -168,24 +264,33 @@ class TradeVisualizer:
                           yaxis_title='EFX/NFX Ratio', yaxis2_title='Volume (EFX)')
 
         # Volume Distribution
+        price_analysis = self.price_analysis.astype({'efx_amount': 'float32', 'trx_id': 'int32'})
         fig2 = make_subplots(rows=1, cols=2, subplot_titles=('Volume by Price Range', 'Trade Count by Price Range'))
         
-        fig2.add_trace(go.Bar(x=[str(x) for x in self.price_analysis['price_range']], 
-                             y=self.price_analysis['efx_amount'],
+        fig2.add_trace(go.Bar(x=price_analysis['price_range'], 
+                             y=price_analysis['efx_amount'],
                              name='Volume (EFX)', marker_color='darkblue'), row=1, col=1)
-        fig2.add_trace(go.Bar(x=[str(x) for x in self.price_analysis['price_range']], 
-                             y=self.price_analysis['trx_id'],
+        fig2.add_trace(go.Bar(x=price_analysis['price_range'], 
+                             y=price_analysis['trx_id'],
                              name='Number of Trades', marker_color='darkgreen'), row=1, col=2)
         
         fig2.update_layout(height=400, title='Trading Activity Distribution',
                           xaxis_title='Price Range (EFX/NFX)', xaxis2_title='Price Range (EFX/NFX)',
                           yaxis_title='Volume (EFX)', yaxis2_title='Number of Trades')
 
-        # Trader Analysis
-        top_traders = self.trades_df.groupby('trader').agg({
-            'efx_amount': 'sum',
-            'trx_id': 'count'
-        }).nlargest(20, 'efx_amount')
+        # Trader Analysis: per-trader totals over the category codes, then
+        # partially select the 20 largest instead of sorting every trader
+        traders = self.trades_df['trader'].cat
+        codes = traders.codes.to_numpy()
+        num_traders = traders.categories.size
+        volumes = np.bincount(codes, weights=self.efx_amount, minlength=num_traders)
+        counts = np.bincount(codes, minlength=num_traders)
+        top = np.argpartition(volumes, -min(20, num_traders))[-20:]
+        top = top[np.argsort(-volumes[top], kind='stable')]
+        top_traders = pd.DataFrame(
+            {'efx_amount': volumes[top].astype(np.float32), 'trx_id': counts[top].astype(np.int32)},
+            index=traders.categories.take(top)
+        )
 
         fig3 = make_subplots(rows=2, cols=1, subplot_titles=('Top 20 Traders by Volume', 'Trade Count'))
         
@@ -201,10 +306,13 @@ class TradeVisualizer:
         # Write the complete HTML file
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write(html_content)
-            f.write(f"<script>")
-            f.write(f"var price_chart = {fig1.to_json()};")
-            f.write(f"var volume_dist = {fig2.to_json()};")
-            f.write(f"var trader_analysis = {fig3.to_json()};")
+            f.write("<script>")
+            # Serialize with orjson and write each figure's JSON straight to the
+            # file; the figures were validated when built, so skip re-validation
+            for name, fig in (('price_chart', fig1), ('volume_dist', fig2), ('trader_analysis', fig3)):
+                f.write(f"var {name} = ")
+                f.write(pio.to_json(fig, validate=False, engine='orjson'))
+                f.write(";")
             f.write("""
                 Plotly.newPlot('price-chart', price_chart.data, price_chart.layout);
                 Plotly.newPlot('volume-dist', volume_dist.data, volume_dist.layout);
@@ -1,26 +1,55 @@
 import requests
 import time
+import atexit
+import argparse
 import sqlite3
 import json
-from typing import Dict, List, Optional
+import zlib
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 from datetime import datetime
 import logging
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
 from pathlib import Path
 
+def decompress_raw(raw_data) -> Dict:
+    """Decode a stored raw_data value (compressed BLOB, or legacy JSON text)"""
+    if isinstance(raw_data, bytes):
+        raw_data = zlib.decompress(raw_data)
+    return json.loads(raw_data)
+
+def split_quantity(quantity: Optional[str]) -> Tuple[Optional[float], Optional[str]]:
+    """Split an asset string like "1.2345 EFX" into (1.2345, "EFX")"""
+    amount, _, symbol = (quantity or '').partition(' ')
+    try:
+        amount = float(amount) if amount else None
+    except ValueError:
+        amount = None
+    return amount, symbol or None
+
 class EOSHistoryFetcher:
     def __init__(
         self,
         target_account: str,
         db_path: str = "eos_history.db",
         max_retries: int = 3,
-        delay_between_requests: int = 1
+        delay_between_requests: int = 1,
+        max_workers: int = 4,
+        store_raw: bool = False
     ):
         """Initialize the EOS history fetcher"""
         self.target_account = target_account
         self.api_endpoint = "https://eos.greymass.com/v1/history/get_actions"
         self.max_retries = max_retries
         self.delay = delay_between_requests
+        self.max_workers = max_workers
+        # Downstream queries only use the flattened columns; the full action
+        # JSON is kept in raw_data only when asked for
+        self.store_raw = store_raw
         self.db_path = db_path
         
         logging.basicConfig(
@@ -29,159 +58,234 @@ class EOSHistoryFetcher:
         )
         self.logger = logging.getLogger(__name__)
         
+        # Keep-alive session so TLS handshakes are reused across requests;
+        # transient failures are retried with exponential backoff
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=None  # get_actions is a read-only POST
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=max_workers, max_retries=retry))
+        
+        # One connection for the fetcher's lifetime keeps SQLite's schema,
+        # page and statement caches warm. Autocommit mode: multi-statement
+        # writes open their own transaction with BEGIN/COMMIT. All database
+        # access happens on the thread that created the fetcher
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row  # This enables accessing columns by name
+        # Write-ahead logging: commits append to the WAL instead of
+        # rewriting pages (persisted in the database file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only fsyncs at checkpoints rather than every commit
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        atexit.register(self.conn.close)
+        
         self.init_db()
 
     def init_db(self):
         """Initialize SQLite database with flattened schema"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Create actions table with flattened structure
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS actions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    global_action_seq INTEGER UNIQUE,
-                    block_num INTEGER,
-                    block_time TEXT,
-                    trx_id TEXT,
-                    actor TEXT,
-                    action_name TEXT,
-                    from_account TEXT,
-                    to_account TEXT,
-                    memo TEXT,
-                    quantity TEXT,
-                    contract TEXT,
-                    raw_data TEXT,
-                    processed_at TEXT
-                )
-            ''')
-            
-            # Create fetch state table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS fetch_state (
-                    account TEXT PRIMARY KEY,
-                    last_position INTEGER,
-                    updated_at TEXT
+        cursor = self.conn.cursor()
+        
+        # Create actions table with flattened structure
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS actions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                global_action_seq INTEGER UNIQUE,
+                block_num INTEGER,
+                block_time TEXT,
+                trx_id TEXT,
+                actor TEXT,
+                action_name TEXT,
+                from_account TEXT,
+                to_account TEXT,
+                memo TEXT,
+                quantity TEXT,
+                qty_amount REAL,
+                qty_symbol TEXT,
+                contract TEXT,
+                raw_data BLOB,
+                processed_at TEXT
+            )
+        ''')
+        
+        # Create fetch state table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS fetch_state (
+                account TEXT PRIMARY KEY,
+                last_position INTEGER,
+                updated_at TEXT
+            )
+        ''')
+        
+        # Databases created before the parsed quantity columns: add them
+        # and backfill from the quantity text with the same parser as ingest
+        columns = {row['name'] for row in cursor.execute("PRAGMA table_info(actions)")}
+        if 'qty_amount' not in columns:
+            cursor.execute("BEGIN")
+            cursor.execute("ALTER TABLE actions ADD COLUMN qty_amount REAL")
+            cursor.execute("ALTER TABLE actions ADD COLUMN qty_symbol TEXT")
+            last_id = 0
+            while True:
+                rows = cursor.execute(
+                    "SELECT id, quantity FROM actions WHERE id > ? ORDER BY id LIMIT 10000",
+                    (last_id,)
+                ).fetchall()
+                if not rows:
+                    break
+                cursor.executemany(
+                    "UPDATE actions SET qty_amount = ?, qty_symbol = ? WHERE id = ?",
+                    [(*split_quantity(row['quantity']), row['id']) for row in rows]
                 )
-            ''')
-            
-            # Create indexes for common queries
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_trx_id ON actions(trx_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_memo ON actions(memo)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_block_time ON actions(block_time)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_from_to ON actions(from_account, to_account)')
-            
-            conn.commit()
+                last_id = rows[-1]['id']
+            cursor.execute("COMMIT")
+        
+        # Create indexes for common queries
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_trx_id ON actions(trx_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_memo ON actions(memo)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_block_time ON actions(block_time)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_from_to ON actions(from_account, to_account)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_action_time ON actions(action_name, block_time)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_symbol_time ON actions(qty_symbol, block_time)')
 
     def get_stored_position(self) -> int:
         """Get the last processed position from database"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT last_position FROM fetch_state WHERE account = ?",
+            (self.target_account,)
+        )
+        result = cursor.fetchone()
+        return result[0] if result else 0
+
+    def get_stored_seqs(self, seqs: List[int]) -> Set[int]:
+        """Return which of the given global_action_seq values are already stored"""
+        stored = set()
+        cursor = self.conn.cursor()
+        # Point lookups on the UNIQUE index for just these sequences, in
+        # chunks that stay under SQLite's bound-parameter limit
+        for i in range(0, len(seqs), 500):
+            chunk = seqs[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
             cursor.execute(
-                "SELECT last_position FROM fetch_state WHERE account = ?",
-                (self.target_account,)
+                f"SELECT global_action_seq FROM actions WHERE global_action_seq IN ({placeholders})",
+                chunk
             )
-            result = cursor.fetchone()
-            return result[0] if result else 0
+            stored.update(row[0] for row in cursor)
+        return stored
 
     def update_position(self, position: int):
         """Update the last processed position in database"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO fetch_state (account, last_position, updated_at)
-                VALUES (?, ?, ?)
-            ''', (self.target_account, position, datetime.utcnow().isoformat()))
-            conn.commit()
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO fetch_state (account, last_position, updated_at)
+            VALUES (?, ?, ?)
+        ''', (self.target_account, position, datetime.utcnow().isoformat()))
 
     def fetch_actions(self, pos: int, offset: int = 100) -> Optional[Dict]:
-        """Fetch actions from the EOS API with retry logic"""
-        for attempt in range(self.max_retries):
-            try:
-                params = {
-                    "account_name": self.target_account,
-                    "pos": pos,
-                    "offset": offset
-                }
-                
-                response = requests.post(self.api_endpoint, json=params)
-                response.raise_for_status()
-                return response.json()
-                
-            except RequestException as e:
-                self.logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
-                if attempt < self.max_retries - 1:
-                    wait_time = (attempt + 1) * 2
-                    self.logger.info(f"Waiting {wait_time} seconds before retry...")
-                    time.sleep(wait_time)
-                else:
-                    self.logger.error(f"Max retries reached for position {pos}")
-                    raise
+        """Fetch actions from the EOS API (retries are handled by the session)"""
+        params = {
+            "account_name": self.target_account,
+            "pos": pos,
+            "offset": offset
+        }
+        
+        try:
+            response = self.session.post(self.api_endpoint, json=params, timeout=(5, 30))
+            response.raise_for_status()
+            return response.json()
+            
+        except RequestException as e:
+            self.logger.error(f"Max retries reached for position {pos}: {str(e)}")
+            raise
 
     def store_actions(self, actions: List[Dict]):
         """Store actions in SQLite database with flattened structure"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            for action in actions:
-                try:
-                    act_trace = action['action_trace']
-                    act = act_trace['act']
-                    data = act.get('data', {})
-                    
-                    # Extract flattened data
-                    action_data = {
-                        'global_action_seq': action['global_action_seq'],
-                        'block_num': action['block_num'],
-                        'block_time': action['block_time'],
-                        'trx_id': act_trace['trx_id'],
-                        'actor': act['authorization'][0]['actor'] if act['authorization'] else None,
-                        'action_name': act['name'],
-                        'from_account': data.get('from'),
-                        'to_account': data.get('to'),
-                        'memo': data.get('memo'),
-                        'quantity': data.get('quantity'),
-                        'contract': act['account'],
-                        'raw_data': json.dumps(action),
-                        'processed_at': datetime.utcnow().isoformat()
-                    }
-                    
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO actions (
-                            global_action_seq, block_num, block_time, trx_id,
-                            actor, action_name, from_account, to_account,
-                            memo, quantity, contract, raw_data, processed_at
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        action_data['global_action_seq'],
-                        action_data['block_num'],
-                        action_data['block_time'],
-                        action_data['trx_id'],
-                        action_data['actor'],
-                        action_data['action_name'],
-                        action_data['from_account'],
-                        action_data['to_account'],
-                        action_data['memo'],
-                        action_data['quantity'],
-                        action_data['contract'],
-                        action_data['raw_data'],
-                        action_data['processed_at']
-                    ))
-                    
-                except Exception as e:
-                    self.logger.error(f"Error storing action {action.get('global_action_seq')}: {str(e)}")
-            
-            conn.commit()
+        # Skip actions that are already stored (window overlaps, re-fetches
+        # on resume) rather than rewriting them with INSERT OR REPLACE
+        stored = self.get_stored_seqs([a['global_action_seq'] for a in actions if 'global_action_seq' in a])
+        actions = [a for a in actions if a.get('global_action_seq') not in stored]
+        if not actions:
+            return
+        
+        processed_at = datetime.utcnow().isoformat()
+        rows = []
+        
+        for action in actions:
+            try:
+                act_trace = action['action_trace']
+                act = act_trace['act']
+                data = act.get('data', {})
+                # Parse the asset once here so queries aggregate a REAL column
+                qty_amount, qty_symbol = split_quantity(data.get('quantity'))
+                
+                # Extract flattened data
+                rows.append((
+                    action['global_action_seq'],
+                    action['block_num'],
+                    action['block_time'],
+                    act_trace['trx_id'],
+                    act['authorization'][0]['actor'] if act['authorization'] else None,
+                    act['name'],
+                    data.get('from'),
+                    data.get('to'),
+                    data.get('memo'),
+                    data.get('quantity'),
+                    qty_amount,
+                    qty_symbol,
+                    act['account'],
+                    # Compact JSON, zlib-compressed: the repeated field
+                    # names compress well (read back with decompress_raw)
+                    zlib.compress(json.dumps(action, separators=(',', ':')).encode(), 3)
+                    if self.store_raw else None,
+                    processed_at
+                ))
+                
+            except Exception as e:
+                self.logger.error(f"Error storing action {action.get('global_action_seq')}: {str(e)}")
+        
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN")
+        try:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO actions (
+                    global_action_seq, block_num, block_time, trx_id,
+                    actor, action_name, from_account, to_account,
+                    memo, quantity, qty_amount, qty_symbol, contract,
+                    raw_data, processed_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
 
-    def fetch_all_history(self):
+    def fetch_all_history(self, offset: int = 100):
         """Main method to fetch all history"""
         pos = self.get_stored_position()
         self.logger.info(f"Starting from position {pos}")
         
+        # Keep up to max_workers requests in flight for consecutive windows
+        # (a window may overlap its predecessor by one action, which
+        # store_actions skips). Results are stored and the position saved
+        # strictly in order on this thread
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        pending = deque()
+        next_pos = pos
+        step = offset
+        largest_page = 0
+        
         try:
             while True:
-                self.logger.info(f"Fetching actions from position {pos}")
-                result = self.fetch_actions(pos)
+                while len(pending) < self.max_workers:
+                    pending.append((next_pos, executor.submit(self.fetch_actions, next_pos, offset)))
+                    next_pos += step
+                
+                start, future = pending.popleft()
+                self.logger.info(f"Fetching actions from position {start}")
+                result = future.result()
                 
                 if not result or not result.get('actions'):
                     self.logger.info("No more actions to fetch")
@@ -190,11 +294,24 @@ class EOSHistoryFetcher:
                 actions = result['actions']
                 self.store_actions(actions)
                 
-                pos += len(actions)
+                pos = start + len(actions)
                 self.update_position(pos)
                 
-                time.sleep(self.delay)
+                # Space windows by the largest page the server has returned
+                # (at most offset), so a server-side page cap doesn't leave gaps
+                # but one stray short page doesn't shrink every later window
+                largest_page = max(largest_page, len(actions))
+                step = min(offset, largest_page)
+                
+                # A short page ends before the next queued window starts:
+                # drop the queue and continue from here
+                if pending and pos < pending[0][0]:
+                    for _, queued in pending:
+                        queued.cancel()
+                    pending.clear()
+                    next_pos = pos
                 
+                time.sleep(self.delay)
                 self.logger.info(f"Processed {len(actions)} actions. New position: {pos}")
                 
         except KeyboardInterrupt:
@@ -203,45 +320,85 @@ class EOSHistoryFetcher:
         except Exception as e:
             self.logger.error(f"Error during processing: {str(e)}")
             self.logger.info("Progress saved. Will resume from last position on next run.")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
-    def query_transactions(self, memos: List[str] = None, start_time: str = None, end_time: str = None) -> List[Dict]:
-        """Query transactions with optional filters"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row  # This enables accessing columns by name
-            cursor = conn.cursor()
-            
-            query = """
-                SELECT 
-                    block_time as time,
-                    trx_id,
-                    from_account as account,
-                    memo,
-                    quantity
-                FROM actions 
-                WHERE action_name = 'transfer'
-            """
-            params = []
-            
-            if memos:
-                memo_placeholders = ','.join('?' * len(memos))
-                query += f" AND memo IN ({memo_placeholders})"
-                params.extend(memos)
-            
-            if start_time:
-                query += " AND block_time >= ?"
-                params.append(start_time)
-            
-            if end_time:
-                query += " AND block_time <= ?"
-                params.append(end_time)
-            
-            query += " ORDER BY block_time ASC"
-            
-            cursor.execute(query, params)
-            return [dict(row) for row in cursor.fetchall()]
+    def query_transactions(self, memos: List[str] = None, start_time: str = None, end_time: str = None,
+                           chunksize: int = 10000) -> Iterator[Dict]:
+        """Query transactions with optional filters, yielding rows chunk by chunk"""
+        cursor = self.conn.cursor()
+        
+        query = """
+            SELECT 
+                block_time as time,
+                trx_id,
+                from_account as account,
+                memo,
+                quantity
+            FROM actions 
+            WHERE action_name = 'transfer'
+        """
+        params = []
+        
+        if memos:
+            memo_placeholders = ','.join('?' * len(memos))
+            query += f" AND memo IN ({memo_placeholders})"
+            params.extend(memos)
+        
+        if start_time:
+            query += " AND block_time >= ?"
+            params.append(start_time)
+        
+        if end_time:
+            query += " AND block_time <= ?"
+            params.append(end_time)
+        
+        query += " ORDER BY block_time ASC"
+        
+        cursor.execute(query, params)
+        # Only one chunk of rows is held in memory at a time
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            yield from (dict(row) for row in rows)
+
+    def daily_summary(self, symbol: str = 'EFX', start_time: str = None, end_time: str = None) -> List[Dict]:
+        """Aggregate transfer count and volume of one token per day in SQLite"""
+        cursor = self.conn.cursor()
+        
+        # Uses the quantity columns parsed at ingest (see store_actions)
+        query = """
+            SELECT 
+                date(block_time) as day,
+                COUNT(*) as transfers,
+                SUM(qty_amount) as volume
+            FROM actions 
+            WHERE action_name = 'transfer'
+                AND qty_symbol = ?
+        """
+        params = [symbol]
+        
+        if start_time:
+            query += " AND block_time >= ?"
+            params.append(start_time)
+        
+        if end_time:
+            query += " AND block_time <= ?"
+            params.append(end_time)
+        
+        query += " GROUP BY day ORDER BY day ASC"
+        
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
 
 def main():
-    fetcher = EOSHistoryFetcher("effecttokens")
+    parser = argparse.ArgumentParser(description="Fetch EOS action history into SQLite")
+    parser.add_argument("--raw", action="store_true",
+                        help="also store each action's full JSON in raw_data")
+    args = parser.parse_args()
+    
+    fetcher = EOSHistoryFetcher("effecttokens", store_raw=args.raw)
     
     try:
         # Fetch history
@@ -252,7 +409,7 @@ def main():
         transactions = fetcher.query_transactions(memos=memos)
         
         print("\nExample Transactions:")
-        for tx in transactions[:5]:  # Show first 5 transactions
+        for tx in islice(transactions, 5):  # Show first 5 transactions
             print(f"Time: {tx['time']}")
             print(f"TrxID: {tx['trx_id']}")
             print(f"Account: {tx['account']}")